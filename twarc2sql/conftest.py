@@ -0,0 +1,112 @@
+"""Contains database fixtures shared by the tests of all modules."""
+
+import pytest
+import sqlalchemy as sa
+import sqlalchemy_utils as sau
+
+from twarc2sql.db_utils import db_access
+
+CONFIG_FILE_PATH = "tests/data/.testenv"
+
+
+# create a fixture that returns a engine:
+@pytest.fixture(scope="module")
+def config_file_path() -> str:
+    """
+    config_file_path _summary_.
+
+    returns a path to a .env file
+
+    Returns
+    -------
+    str
+        path to a .env file
+    """
+    return CONFIG_FILE_PATH
+
+
+@pytest.fixture(scope="session")
+def template_uri() -> sa.engine.URL:
+    """
+    template_uri creates a template database with all tables.
+
+    The tables are created once per test session, tests then clone the
+    template with CREATE DATABASE ... TEMPLATE instead of creating them again.
+
+    Returns
+    -------
+    sa.engine.URL
+        URI of the template database
+    """
+    from twarc2sql.db_utils.models import Base
+
+    config = db_access.get_db_config(CONFIG_FILE_PATH)
+    uri = config.uri.set(database=f"{config.name}_template")
+    if sau.database_exists(uri):
+        sau.drop_database(uri)
+    sau.create_database(uri)
+    # no pooled connections may be left, a template cannot be copied while in use
+    engine = sa.create_engine(uri, poolclass=sa.pool.NullPool)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    yield uri
+    sau.drop_database(uri)
+
+
+@pytest.fixture(scope="module")
+def db_with_tables(config_file_path, template_uri) -> sa.engine.base.Engine:
+    """
+    db_with_tables returns an engine for a database with all tables.
+
+    The database is cloned from the template database once per test module;
+    the tests of a module share its rows. It is named after the configured
+    database with a _data suffix, so it does not collide with the database
+    that the engine fixture and the create/delete tests use.
+
+    Parameters
+    ----------
+    config_file_path : str
+        path to a .env file
+    template_uri : sa.engine.URL
+        URI of the template database
+
+    Returns
+    -------
+    sa.engine.base.Engine
+        sqlalchemy engine
+    """
+    config = db_access.get_db_config(config_file_path)
+    uri = config.uri.set(database=f"{config.name}_data")
+    if sau.database_exists(uri):
+        sau.drop_database(uri)
+    sau.create_database(uri, template=template_uri.database)
+    engine = db_access.create_engine(uri)
+    yield engine
+    engine.dispose()
+    sau.drop_database(uri)
+
+
+@pytest.fixture
+def db_session(db_with_tables) -> sa.engine.Connection:
+    """
+    db_session returns a connection in a transaction that is rolled back.
+
+    Tests that only add rows use this fixture, so they share the database of
+    the module without seeing each other's rows and without creating or
+    deleting a database.
+
+    Parameters
+    ----------
+    db_with_tables : sa.engine.base.Engine
+        sqlalchemy engine for a database with all tables
+
+    Returns
+    -------
+    sa.engine.Connection
+        connection with an open transaction
+    """
+    connection = db_with_tables.connect()
+    transaction = connection.begin()
+    yield connection
+    transaction.rollback()
+    connection.close()
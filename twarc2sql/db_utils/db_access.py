@@ -4,47 +4,150 @@ Module for accessing the database.
 Module contains functions for creating and deleting databases & their 
 tables as defined in models.py.
 
+sqlalchemy_utils and dotenv are imported inside the functions that need them,
+so importing this module (e.g. only to build a URI) stays cheap.
+
 """
 
+import io
 import logging
 import os
-from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
-import dotenv
 import sqlalchemy as sa
-import sqlalchemy_utils as sau
-
-from .models import Base
-
-logging.basicConfig(level=logging.INFO)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import MATERIALIZED_VIEWS, STAGE_TABLES, Base
+
+__all__ = [
+    "DatabaseException",
+    "DBConfig",
+    "create_uri",
+    "create_engine",
+    "dispose_engines",
+    "load_db_config",
+    "get_db_config",
+    "create_db",
+    "delete_db",
+    "create_tables",
+    "create_db_with_tables",
+    "get_engine",
+    "bulk_insert",
+    "bulk_insert_tables",
+    "copy_rows",
+    "on_duplicate_do_nothing",
+    "refresh_materialized_views",
+    "bulk_load_context",
+]
+
+logger = logging.getLogger(__name__)
+
+# Variables that must be set in the .env file to connect to the database
+REQUIRED_VARS: Tuple[str, ...] = (
+    "DB_NAME",
+    "DB_USER",
+    "DB_PASSWORD",
+    "DB_HOST",
+    "DB_PORT",
+)
+
+# Database variables loaded from .env files, keyed by (absolute path, mtime)
+# so an edited file is picked up again on the next call.
+_config_cache: Dict[Tuple[str, float], "DBConfig"] = {}
+
+# (database URL, declarative base) pairs whose tables are known to exist, so
+# create_tables does not inspect the database again for them.
+_tables_created: Set[Tuple[sa.engine.URL, Any]] = set()
+
+# Characters escaped in values sent with COPY ... FROM STDIN (text format)
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+# Engines shared by every caller in the process, keyed by URI and echo flag, so
+# that the connection pool and dialect initialisation are only paid for once.
+_EngineKey = Tuple[Union[str, sa.engine.URL], bool]
+_engine_cache: Dict[_EngineKey, sa.engine.base.Engine] = {}
 
 
 class DatabaseException(Exception):
     """Exception for database errors."""
 
-    def __init__(self, message: str):
-        """
-        Exception for database errors.
 
-        Parameters
-        ----------
-        message : str
-            The error message
+@dataclass(frozen=True)
+class DBConfig:
+    """
+    Database settings loaded from a .env file.
+
+    Attributes
+    ----------
+    name : str
+        the name of the database
+    user : str
+        the username for authentication to connect to the database
+    password : str
+        the password for authentication to connect to the database
+    host : str
+        the host of the database
+    port : str
+        the port of the database
+    uri : sa.engine.URL
+        the URI for the database, built once from the settings above
+    """
+
+    __slots__ = ("name", "user", "password", "host", "port", "uri")
+
+    name: str
+    user: str
+    password: str
+    host: str
+    port: str
+    uri: sa.engine.URL
 
-        Attributes
-        ----------
-        message : str
-            The error message
+    def to_dict(self) -> Dict[str, str]:
         """
-        self.message = message
+        Return the settings keyed by their .env variable names.
+
+        Returns
+        -------
+        db_variables : Dict[str, str]
+            Dictionary of the database variables
+        """
+        return {
+            "DB_NAME": self.name,
+            "DB_USER": self.user,
+            "DB_PASSWORD": self.password,
+            "DB_HOST": self.host,
+            "DB_PORT": self.port,
+        }
 
 
+@lru_cache(maxsize=32)
 def create_uri(
     db_name: str, db_user: str, db_password: str, db_host: str, db_port: str
-) -> str:
+) -> sa.engine.URL:
     """
     Create a URI for a database connection using the specified parameters.
 
+    The URI is built as a SQLAlchemy URL object, so special characters in the
+    credentials do not need to be escaped and the URL is not parsed again
+    when an engine is created. URL objects are immutable, so the URI is cached
+    per set of arguments and the same object is returned for repeated calls.
+
     Parameters
     ----------
     db_name : str
@@ -60,42 +163,163 @@ def create_uri(
 
     Returns
     -------
-    uri: str
+    uri: sa.engine.URL
         the URI for the database
     """
-    logging.info(f"Creating URI for {db_name} database")
-    uri = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+    logger.info("Creating URI for %s database", db_name)
+    uri = sa.engine.URL.create(
+        drivername="postgresql+psycopg2",
+        username=db_user,
+        password=db_password,
+        host=db_host,
+        port=int(db_port),
+        database=db_name,
+    )
     return uri
 
 
-def create_engine(uri: str) -> sa.engine.base.Engine:
+def create_engine(
+    uri: Union[str, sa.engine.URL], echo: Optional[bool] = None
+) -> sa.engine.base.Engine:
     """
     Create a SQLAlchemy engine for the database specified by the URI.
 
+    Engines are cached per URI, so every call with the same URI returns the
+    same engine and shares its connection pool. Pooled connections are checked
+    before use and recycled after half an hour. With psycopg2, executemany inserts
+    are sent as multi-row VALUES pages of 1000 rows, and other executemany
+    statements (e.g. updates) with psycopg2's execute_batch.
+
     Parameters
     ----------
-    uri : str
+    uri : Union[str, sa.engine.URL]
         URI for the database to connect to or create
+    echo : Optional[bool], optional
+        Whether to log every SQL statement. If None, statements are logged only
+        when the environment variable ``TWARC2SQL_SQL_ECHO`` is set to ``1``,
+        by default None
 
     Returns
     -------
     engine: sa.engine.base.Engine
         SQLAlchemy engine for the database
     """
-    # TODO: Stop displaying the password in the logs & maybe allow users to specify echo
-    logging.info(f"Creating engine for {uri}")
-    engine = sa.create_engine(uri, echo=True)
-    logging.info(f"Engine created successfully for database {uri}")
+    if echo is None:
+        echo = os.environ.get("TWARC2SQL_SQL_ECHO", "") == "1"
+
+    engine = _engine_cache.get((uri, echo))
+    if engine is None:
+        # the password is masked when a URL object is formatted
+        logger.info("Creating engine for %s", uri)
+        dialect_options = {}
+        if sa.engine.make_url(uri).get_driver_name() == "psycopg2":
+            dialect_options = {
+                "executemany_mode": "values_plus_batch",
+                "executemany_batch_page_size": 500,
+            }
+        # pre-ping replaces connections dropped since they were pooled, e.g.
+        # after the database was deleted and created again
+        engine = sa.create_engine(
+            uri,
+            echo=echo,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            pool_size=10,
+            max_overflow=20,
+            pool_timeout=30,
+            insertmanyvalues_page_size=1000,
+            **dialect_options,
+        )
+        _engine_cache[(uri, echo)] = engine
+        logger.info("Engine created successfully for database %s", uri)
     return engine
 
 
-def load_db_config(file_path: Optional[str] = None) -> Dict[str, str]:
+def dispose_engines() -> None:
+    """
+    Dispose of all cached engines and empty the engine cache.
+
+    Closes every pooled connection, e.g. before dropping a database or at the
+    end of a test session.
+    """
+    for engine in _engine_cache.values():
+        engine.dispose()
+    _engine_cache.clear()
+
+
+def get_db_config(file_path: Optional[Union[str, Path]] = None) -> DBConfig:
+    """
+    Load the database settings and URI from the .env file at file_path.
+
+    The variables are read from the file only; the process environment is
+    neither read nor modified. The result is cached per file path and
+    modification time, so repeated calls do not re-read the file or rebuild the
+    URI. Use ``get_db_config.cache_clear()`` to reset it.
+
+    Parameters
+    ----------
+    file_path : Optional[Union[str, Path]], optional
+        Path to the .env file. If None, defaults to .env in the current directory,
+        by default None
+
+    Returns
+    -------
+    config : DBConfig
+        The database settings
+
+    Raises
+    ------
+    FileNotFoundError :
+        if the environment file specified does not exist
+    KeyError :
+        if any of the database variables is not set in the file
+    """
+    file_path = Path(".env" if file_path is None else file_path)
+
+    # stat raises FileNotFoundError if the file does not exist
+    cache_key = (str(file_path.absolute()), file_path.stat().st_mtime)
+    if cache_key in _config_cache:
+        return _config_cache[cache_key]
+
+    import dotenv
+
+    logger.info("Loading environment variables from %s", file_path)
+    values = dotenv.dotenv_values(file_path)
+    missing = [var for var in REQUIRED_VARS if values.get(var) is None]
+    if missing:
+        raise KeyError(f"{missing} not set in {file_path}")
+
+    config = DBConfig(
+        name=values["DB_NAME"],
+        user=values["DB_USER"],
+        password=values["DB_PASSWORD"],
+        host=values["DB_HOST"],
+        port=values["DB_PORT"],
+        uri=create_uri(
+            db_name=values["DB_NAME"],
+            db_user=values["DB_USER"],
+            db_password=values["DB_PASSWORD"],
+            db_host=values["DB_HOST"],
+            db_port=values["DB_PORT"],
+        ),
+    )
+    logger.info("Loaded environment variables")
+    _config_cache[cache_key] = config
+    return config
+
+
+get_db_config.cache_clear = _config_cache.clear
+
+
+def load_db_config(file_path: Optional[Union[str, Path]] = None) -> Dict[str, str]:
     """
     Load env variables from file_path and return a dictionary of the database variables.
 
+    This is a wrapper around get_db_config, which caches the settings.
+
     Parameters
     ----------
-    file_path : Optional[str], optional
+    file_path : Optional[Union[str, Path]], optional
         Path to the .env file. If None, defaults to .env in the current directory,
         by default None
 
@@ -106,25 +330,15 @@ def load_db_config(file_path: Optional[str] = None) -> Dict[str, str]:
 
     Raises
     ------
-    AssertionError :
+    FileNotFoundError :
         if the environment file specified does not exist
-        or if the environment variables are not set
+    KeyError :
+        if any of the database variables is not set in the file
     """
-    if file_path is None:
-        file_path = ".env"
-
-    logging.info(f"Loading environment variables from {file_path}")
-    assert os.path.exists(file_path), f"{file_path} does not exist"
-    load_env = dotenv.load_dotenv(file_path)
-    assert load_env is True, "Failed to load environment variables"
+    return get_db_config(file_path).to_dict()
 
-    db_vars: List[str] = ["DB_NAME", "DB_USER", "DB_PASSWORD", "DB_HOST", "DB_PORT"]
-    for var in db_vars:
-        assert os.getenv(var) is not None, f"{var} is not set in {file_path}"
 
-    db_variables: Dict[str, str] = {var: os.getenv(var) for var in db_vars}
-    logging.info("Loaded environment variables")
-    return db_variables
+load_db_config.cache_clear = _config_cache.clear
 
 
 def create_db(config_file_path: Optional[str] = None) -> sa.engine.base.Engine:
@@ -149,33 +363,24 @@ def create_db(config_file_path: Optional[str] = None) -> sa.engine.base.Engine:
     sa.exc.OperationalError
         if the database could not be created
     """
-    db_vars = load_db_config(config_file_path)
-    logging.info(f"Creating {db_vars['DB_NAME']} database")
+    import sqlalchemy_utils as sau
 
-    uri = create_uri(
-        db_name=db_vars["DB_NAME"],
-        db_user=db_vars["DB_USER"],
-        db_password=db_vars["DB_PASSWORD"],
-        db_host=db_vars["DB_HOST"],
-        db_port=db_vars["DB_PORT"],
-    )
+    config = get_db_config(config_file_path)
+    logger.info("Creating %s database", config.name)
+
+    uri = config.uri
     engine = create_engine(uri)
 
-    if not sau.database_exists(uri):
+    db_exists: bool = sau.database_exists(uri)
+    if not db_exists:
         sau.create_database(uri)
+        _forget_tables(uri)
     else:
-        logging.error(
-            f"Failed to create {db_vars['DB_NAME']} database as it already exists"
-        )
-        raise DatabaseException(f"{db_vars['DB_NAME']} database already exists")
+        logger.error("Failed to create %s database as it already exists", config.name)
+        raise DatabaseException(f"{config.name} database already exists")
 
-    try:
-        connect = engine.connect()
-        connect.close()
-    except sa.exc.OperationalError:
-        logging.error(f"Failed to connect & create {db_vars['DB_NAME']} database")
-        raise sa.exc.OperationalError
-    logging.info(f"Successfully created {db_vars['DB_NAME']} database")
+    # connections are validated by the pool's pre-ping when first checked out
+    logger.info("Successfully created %s database", config.name)
 
     return engine
 
@@ -189,8 +394,8 @@ def delete_db(config_file_path: Optional[str] = None) -> bool:
 
     Note
     ----
-    This is not a guarantee that the database was deleted.
-    The database may not exist in the first place.
+    The existence of the database is only checked once; dropping it raises
+    if it fails, so no second round-trip is needed to confirm the deletion.
 
     Parameters
     ----------
@@ -201,38 +406,52 @@ def delete_db(config_file_path: Optional[str] = None) -> bool:
     Returns
     -------
     db_does_not_exist : bool
-        True if the database does not exist, False otherwise
+        True once the database does not exist
     """
-    # use the cache load_db_config?
-    db_vars: Dict[Any] = load_db_config(config_file_path)
+    import sqlalchemy_utils as sau
 
-    logging.info(f"Deleting {db_vars['DB_NAME']} database")
+    config = get_db_config(config_file_path)
 
-    uri: str = create_uri(
-        db_name=db_vars["DB_NAME"],
-        db_user=db_vars["DB_USER"],
-        db_password=db_vars["DB_PASSWORD"],
-        db_host=db_vars["DB_HOST"],
-        db_port=db_vars["DB_PORT"],
-    )
+    logger.info("Deleting %s database", config.name)
 
-    if sau.database_exists(uri):
+    uri = config.uri
+
+    db_exists: bool = sau.database_exists(uri)
+    if db_exists:
+        # drop_database raises if the database could not be dropped
         sau.drop_database(uri)
-        logging.info(
-            f"Successfully executed delete command {db_vars['DB_NAME']} database"
-        )
+        _forget_tables(uri)
+        logger.info("Successfully executed delete command %s database", config.name)
     else:
-        logging.warning(f"{db_vars['DB_NAME']} database does not exist")
+        logger.warning("%s database does not exist", config.name)
+
+    return True
+
+
+def _forget_tables(uri: sa.engine.URL) -> None:
+    """
+    Forget that the tables of a database were created.
 
-    db_does_not_exist: bool = not sau.database_exists(uri)
+    Called whenever the database is created or deleted, as any tables it had
+    are gone.
 
-    return db_does_not_exist
+    Parameters
+    ----------
+    uri : sa.engine.URL
+        URI of the database
+    """
+    for key in [key for key in _tables_created if key[0] == uri]:
+        _tables_created.discard(key)
 
 
 def create_tables(engine: sa.engine, base: Any) -> None:
     """
     Create the tables for the database.
 
+    Only the tables that do not exist yet are created, using a single
+    inspection of the database. Once the tables of a database are created,
+    later calls for the same database and base return immediately.
+
     Parameters
     ----------
     engine : sa.engine
@@ -245,10 +464,25 @@ def create_tables(engine: sa.engine, base: Any) -> None:
     -------
     None
     """
-    tables_created: List[str] = [table for table in base.metadata.tables.keys()]
-    logging.info(f"Creating tables {tables_created} for database")
-    base.metadata.create_all(engine)
-    logging.info("Successfully created tables for database")
+    key = (engine.url, base)
+    if key in _tables_created:
+        return
+
+    existing_tables = set(sa.inspect(engine).get_table_names())
+    pending_tables = [
+        table
+        for name, table in base.metadata.tables.items()
+        if name not in existing_tables
+    ]
+    if pending_tables:
+        logger.info(
+            "Creating tables %s for database", [table.name for table in pending_tables]
+        )
+        # checkfirst also covers the named types (e.g. enums) the pending tables
+        # share with tables that already exist
+        base.metadata.create_all(engine, tables=pending_tables, checkfirst=True)
+        logger.info("Successfully created tables for database")
+    _tables_created.add(key)
 
 
 def create_db_with_tables(
@@ -257,7 +491,9 @@ def create_db_with_tables(
     """
     Create a database and create the tables for the database.
 
-    This is a wrapper function for create_db and create_tables functions
+    The database is created only if it does not exist yet; the tables are then
+    created with create_tables. The configuration is loaded once and a single
+    engine is used for both steps.
 
     Parameters
     ----------
@@ -270,14 +506,20 @@ def create_db_with_tables(
     engine : sa.engine.base.Engine
         SQLAlchemy engine for the database created
     """
-    logging.info("Creating database and tables")
-    try:
-        engine = create_db(config_file_path)
-    except DatabaseException:
-        logging.info("Database already exists. Creating tables")
-        engine = get_engine(config_file_path)
+    import sqlalchemy_utils as sau
+
+    config = get_db_config(config_file_path)
+    logger.info("Creating database and tables")
+    uri = config.uri
+    engine = create_engine(uri)
+
+    if not sau.database_exists(uri):
+        sau.create_database(uri)
+        _forget_tables(uri)
+    else:
+        logger.info("Database already exists. Creating tables")
     create_tables(engine, Base)
-    logging.info("Successfully created database and tables")
+    logger.info("Successfully created database and tables")
     return engine
 
 
@@ -301,19 +543,382 @@ def get_engine(config_file_path: Optional[str] = None) -> sa.engine.base.Engine:
     DatabaseException
         if the database does not exist
     """
-    db_vars = load_db_config(config_file_path)
-    logging.info(f"Getting engine for {db_vars['DB_NAME']} database")
-    uri = create_uri(
-        db_name=db_vars["DB_NAME"],
-        db_user=db_vars["DB_USER"],
-        db_password=db_vars["DB_PASSWORD"],
-        db_host=db_vars["DB_HOST"],
-        db_port=db_vars["DB_PORT"],
-    )
+    import sqlalchemy_utils as sau
+
+    config = get_db_config(config_file_path)
+    logger.info("Getting engine for %s database", config.name)
+    uri = config.uri
+    # check if the database exists before creating an engine for it:
+    db_exists: bool = sau.database_exists(uri)
+    if not db_exists:
+        logger.error("%s database does not exist", config.name)
+        raise DatabaseException(f"{config.name} database does not exist")
     engine = create_engine(uri)
-    logging.info(f"Successfully got engine for {db_vars['DB_NAME']} database")
-    # check if the database exists:
-    if not sau.database_exists(uri):
-        logging.error(f"{db_vars['DB_NAME']} database does not exist")
-        raise DatabaseException(f"{db_vars['DB_NAME']} database does not exist")
+    logger.info("Successfully got engine for %s database", config.name)
     return engine
+
+
+def _insert_batches(
+    connection: sa.engine.Connection,
+    table: sa.Table,
+    rows: Iterable[Dict[str, Any]],
+    batch_size: int,
+) -> int:
+    """
+    Insert rows into a table in batches on an open connection.
+
+    Parameters
+    ----------
+    connection : sa.engine.Connection
+        the connection to insert the rows with
+    table : sa.Table
+        the table to insert the rows into
+    rows : Iterable[Dict[str, Any]]
+        the rows to insert, as dictionaries keyed by column name
+    batch_size : int
+        the number of rows sent per statement
+
+    Returns
+    -------
+    inserted : int
+        the number of rows inserted
+    """
+    rows = iter(rows)
+    inserted = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        connection.execute(table.insert(), batch)
+        inserted += len(batch)
+    logger.info("Inserted %s rows into %s", inserted, table.name)
+    return inserted
+
+
+def bulk_insert(
+    bind: Union[sa.engine.base.Engine, sa.engine.Connection],
+    model: Any,
+    rows: Iterable[Dict[str, Any]],
+    batch_size: int = 5000,
+) -> int:
+    """
+    Insert rows into the table of a model in batches.
+
+    Each batch is sent as a single executemany call through SQLAlchemy Core,
+    instead of one INSERT per ORM object. With an engine all batches are
+    inserted in one transaction; with a connection the rows are inserted in
+    the transaction of the caller.
+
+    Parameters
+    ----------
+    bind : Union[sa.engine.base.Engine, sa.engine.Connection]
+        SQLAlchemy engine or connection for the database
+    model : Any
+        the model class (e.g. Tweet) or table to insert the rows into
+    rows : Iterable[Dict[str, Any]]
+        the rows to insert, as dictionaries keyed by column name
+    batch_size : int, optional
+        the number of rows sent per statement, by default 5000
+
+    Returns
+    -------
+    inserted : int
+        the number of rows inserted
+    """
+    table = getattr(model, "__table__", model)
+    if isinstance(bind, sa.engine.Connection):
+        return _insert_batches(bind, table, rows, batch_size)
+    with bind.begin() as connection:
+        return _insert_batches(connection, table, rows, batch_size)
+
+
+def bulk_insert_tables(
+    engine: sa.engine.base.Engine,
+    rows_by_model: Dict[Any, Iterable[Dict[str, Any]]],
+    batch_size: int = 5000,
+) -> Dict[str, int]:
+    """
+    Insert rows into several tables in a single transaction.
+
+    The tables are filled in dependency order (e.g. author before tweet
+    before the mapping tables), whatever the order of rows_by_model, so the
+    foreign keys are satisfied. Either all rows are inserted or none.
+
+    Parameters
+    ----------
+    engine : sa.engine.base.Engine
+        SQLAlchemy engine for the database
+    rows_by_model : Dict[Any, Iterable[Dict[str, Any]]]
+        the rows to insert for each model class or table
+    batch_size : int, optional
+        the number of rows sent per statement, by default 5000
+
+    Returns
+    -------
+    inserted : Dict[str, int]
+        the number of rows inserted per table name
+    """
+    rows_by_table = {
+        getattr(model, "__table__", model): rows
+        for model, rows in rows_by_model.items()
+    }
+    ordered_tables = [
+        table for table in Base.metadata.sorted_tables if table in rows_by_table
+    ]
+    # tables outside of the models keep the order they were given in
+    ordered_tables += [table for table in rows_by_table if table not in ordered_tables]
+
+    inserted = {}
+    with engine.begin() as connection:
+        for table in ordered_tables:
+            inserted[table.name] = _insert_batches(
+                connection, table, rows_by_table[table], batch_size
+            )
+    return inserted
+
+
+def on_duplicate_do_nothing(table: Any, conn: Any, keys: Any, data_iter: Any) -> None:
+    """
+    Insert rows with pandas' to_sql, skipping rows that already exist.
+
+    This function is used as the method of DataFrame.to_sql. Rows whose
+    primary key is already in the table are skipped by PostgreSQL in the same
+    statement (INSERT ... ON CONFLICT DO NOTHING), without looking them up
+    first and without throwing an error. The rows are sent as an executemany
+    of one cached statement, which the engine batches into multi-row VALUES.
+
+    Parameters
+    ----------
+    table : Any
+        the pandas SQLTable to upload the data to
+
+    conn : Any
+        the connection to the database
+
+    keys : Any
+        the names of the columns of the data
+
+    data_iter : Any
+        the data to upload to the database
+
+    """
+    primary_key = [column.name for column in table.table.primary_key.columns]
+    on_duplicate_key_stmt = pg_insert(table.table).on_conflict_do_nothing(
+        index_elements=primary_key or None
+    )
+    records = [dict(zip(keys, row)) for row in data_iter]
+    if records:
+        conn.execute(on_duplicate_key_stmt, records)
+
+
+def _copy_value(value: Any) -> str:
+    """
+    Format a value for COPY ... FROM STDIN in PostgreSQL's text format.
+
+    Parameters
+    ----------
+    value : Any
+        the value to format; None is sent as NULL
+
+    Returns
+    -------
+    str
+        the escaped value
+    """
+    if value is None:
+        return "\\N"
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def copy_rows(
+    connection: sa.engine.Connection,
+    table: str,
+    rows: Iterable[Sequence[Any]],
+    columns: List[str],
+    skip_duplicates: bool = False,
+) -> None:
+    """
+    Load rows into a table with PostgreSQL's COPY ... FROM STDIN.
+
+    COPY streams all rows in one command, with much less per-row overhead than
+    INSERT statements. COPY does not handle conflicts: with skip_duplicates
+    the rows are copied into a staging table first and moved with
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING, so rows already in the table
+    are skipped. The UNLOGGED staging table of the models is used when the
+    table has one (it is locked until the end of the transaction), otherwise
+    a temporary table. Columns left out of ``columns`` get their default values.
+    On other databases the rows are inserted with a single executemany call
+    instead, without conflict handling.
+
+    Parameters
+    ----------
+    connection : sa.engine.Connection
+        connection to the database; the rows are loaded in its transaction
+    table : str
+        the name of the table to load the rows into
+    rows : Iterable[Sequence[Any]]
+        the rows to load, with values in the order of ``columns``;
+        None values are loaded as NULL
+    columns : List[str]
+        the names of the columns to load
+    skip_duplicates : bool, optional
+        skip rows that conflict with rows already in the table,
+        by default False
+    """
+    if connection.dialect.name != "postgresql":
+        records = [dict(zip(columns, row)) for row in rows]
+        if records:
+            connection.execute(
+                sa.table(table, *map(sa.column, columns)).insert(), records
+            )
+        return
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(map(_copy_value, row)))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    quote = connection.dialect.identifier_preparer.quote
+    column_list = ", ".join(quote(column) for column in columns)
+    target = quote(table)
+    cursor = connection.connection.cursor()
+    try:
+        if not skip_duplicates:
+            cursor.copy_expert(f"COPY {target} ({column_list}) FROM STDIN", buffer)
+            return
+
+        if table in STAGE_TABLES:
+            staging = quote(STAGE_TABLES[table].name)
+            # TRUNCATE needs this lock anyway, taking it first keeps concurrent
+            # loads from deadlocking on the staging table
+            cursor.execute(f"LOCK TABLE {staging} IN ACCESS EXCLUSIVE MODE")
+            cleanup = f"TRUNCATE {staging}"
+        else:
+            staging = quote(f"{table}_copy")
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {staging} (LIKE {target} INCLUDING DEFAULTS)"
+            )
+            cleanup = f"DROP TABLE {staging}"
+        cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN", buffer)
+        cursor.execute(
+            f"INSERT INTO {target} ({column_list}) "
+            f"SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING"
+        )
+        cursor.execute(cleanup)
+    finally:
+        cursor.close()
+
+
+def refresh_materialized_views(
+    engine: sa.engine.base.Engine, concurrently: bool = True
+) -> None:
+    """
+    Refresh the materialized views of the models after an upload.
+
+    Views that do not exist in the database (e.g. a database created before
+    the view was added) are skipped.
+
+    Parameters
+    ----------
+    engine : sa.engine.base.Engine
+        SQLAlchemy engine for the database
+    concurrently : bool, optional
+        refresh without locking out readers of the views, by default True
+
+    Returns
+    -------
+    None
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    existing_views = set(sa.inspect(engine).get_materialized_view_names())
+    option = "CONCURRENTLY " if concurrently else ""
+    with engine.begin() as connection:
+        for view in MATERIALIZED_VIEWS:
+            if view not in existing_views:
+                continue
+            logger.info("Refreshing materialized view %s", view)
+            connection.execute(sa.text(f"REFRESH MATERIALIZED VIEW {option}{view}"))
+
+
+@contextmanager
+def bulk_load_context(engine: sa.engine.base.Engine) -> Iterator[None]:
+    """
+    Drop the foreign keys of the tables for the duration of a bulk load.
+
+    Without the foreign keys, rows are loaded without a lookup in the
+    referenced table for every row. On exit the foreign keys are added back
+    as NOT VALID, which does not scan the tables, and then validated one by
+    one, which does not block writes to the tables.
+
+    Parameters
+    ----------
+    engine : sa.engine.base.Engine
+        SQLAlchemy engine for the database
+
+    Yields
+    ------
+    None
+
+    Raises
+    ------
+    sqlalchemy.exc.IntegrityError
+        if the loaded rows violate a foreign key; the foreign key stays
+        NOT VALID but is enforced for new rows
+    """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+
+    quote = engine.dialect.identifier_preparer.quote
+    inspector = sa.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    foreign_keys = [
+        (table.name, foreign_key)
+        for table in Base.metadata.sorted_tables
+        if table.name in existing_tables
+        for foreign_key in inspector.get_foreign_keys(table.name)
+    ]
+
+    with engine.begin() as connection:
+        for table, foreign_key in foreign_keys:
+            connection.execute(
+                sa.text(
+                    f"ALTER TABLE {quote(table)} "
+                    f"DROP CONSTRAINT {quote(foreign_key['name'])}"
+                )
+            )
+    logger.info("Dropped %s foreign keys for bulk load", len(foreign_keys))
+
+    try:
+        yield
+    finally:
+        with engine.begin() as connection:
+            for table, foreign_key in foreign_keys:
+                columns = ", ".join(map(quote, foreign_key["constrained_columns"]))
+                referred = ", ".join(map(quote, foreign_key["referred_columns"]))
+                options = "".join(
+                    f" ON {action.upper()} {foreign_key['options'][action]}"
+                    for action in ("ondelete", "onupdate")
+                    if foreign_key["options"].get(action)
+                )
+                connection.execute(
+                    sa.text(
+                        f"ALTER TABLE {quote(table)} "
+                        f"ADD CONSTRAINT {quote(foreign_key['name'])} "
+                        f"FOREIGN KEY ({columns}) "
+                        f"REFERENCES {quote(foreign_key['referred_table'])} "
+                        f"({referred}){options} NOT VALID"
+                    )
+                )
+        for table, foreign_key in foreign_keys:
+            with engine.begin() as connection:
+                connection.execute(
+                    sa.text(
+                        f"ALTER TABLE {quote(table)} "
+                        f"VALIDATE CONSTRAINT {quote(foreign_key['name'])}"
+                    )
+                )
+        logger.info("Restored %s foreign keys after bulk load", len(foreign_keys))
@@ -5,28 +5,96 @@ It is an opnionated normalization of the Tweet object
 to make it easier to query the database.
 """
 
+from enum import IntEnum
+
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
+    Enum,
     ForeignKey,
+    Index,
     Integer,
+    SmallInteger,
     String,
+    Table,
     Text,
     Float,
+    column,
+    event,
+    table,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import DDL
 
 Base = declarative_base()
 
+# The reply settings type is owned by the metadata, so it is created once
+# (with checkfirst) before the tables that use it, e.g. tweet and tweet_stage,
+# instead of by each table
+REPLY_SETTINGS = Enum(
+    "everyone",
+    "mentionedUsers",
+    "following",
+    "subscribers",
+    "verified",
+    name="reply_settings",
+    metadata=Base.metadata,
+)
+
+# Null bytes are not allowed in PostgreSQL text, replace them with U+FFFD
+_NULL_TRANS = str.maketrans({"\x00": "\ufffd"})
+
+
+def sanitize_text(text: str) -> str:
+    """
+    Replace the null bytes of a text so it can be stored in PostgreSQL.
+
+    The text is only rewritten if it contains a null byte.
+
+    Parameters
+    ----------
+    text : str
+        the text to sanitize
+
+    Returns
+    -------
+    str
+        the text without null bytes
+    """
+    if "\x00" in text:
+        return text.translate(_NULL_TRANS)
+    return text
+
+
+class AnnotationType(IntEnum):
+    """The entity types of tweet annotations, stored as small integers."""
+
+    PERSON = 1
+    PLACE = 2
+    PRODUCT = 3
+    ORGANIZATION = 4
+    OTHER = 5
+
 
 class Tweet(Base):
     __tablename__ = "tweet"
 
+    # BRIN keeps min/max per block range, small for time-ordered inserts
+    __table_args__ = (
+        Index(
+            "ix_tweet_created_at_brin",
+            "created_at",
+            postgresql_using="brin",
+            postgresql_with={"pages_per_range": 32},
+        ),
+    )
+
     id = Column(
-        String(256),
+        BigInteger,
         primary_key=True,
         nullable=False,
         unique=True,
@@ -35,19 +103,24 @@ class Tweet(Base):
     created_at = Column(DateTime, doc="The date and time when the tweet was created")
     text = Column(Text, doc="The text of the tweet")
     possibly_sensitive = Column(Boolean, doc="Whether the tweet is possibly sensitive")
-    conversation_id = Column(Text, doc="The conversation id of the tweet")
+    conversation_id = Column(BigInteger, doc="The conversation id of the tweet")
     author_id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("author.id"),
         nullable=False,
+        index=True,
         doc="The author of the tweet",
     )
-    # TODO: it's a Literal, find the complete list of possible values
-    reply_settings = Column(Text, nullable=True, doc="The reply settings of the tweet")
-    lang = Column(Text, nullable=True, doc="The language of the tweet")
+    reply_settings = Column(
+        REPLY_SETTINGS,
+        nullable=True,
+        doc="The reply settings of the tweet",
+    )
+    # BCP 47 language tag, e.g. "en" or "qme"
+    lang = Column(String(16), nullable=True, doc="The language of the tweet")
     # TODO: Add FOREIGN KEY constraint
     in_reply_to_user_id = Column(
-        String(256),
+        BigInteger,
         nullable=True,
         doc="The user id of the user the tweet is replying to",
     )
@@ -76,22 +149,24 @@ class Tweet(Base):
     #     DateTime, doc="The date and time when the tweet can no longer be edited"
     # )
 
-    author = relationship("Author", back_populates="tweets")
-
-    @property
-    def clean_text(self):
-        """
-        Remove newlines from the tweet text.
-        """
-        if self.text:
-            self.text = self.text.replace("\x00", "\uFFFD")
+    # raise instead of emitting a query per tweet, load with joinedload/selectinload
+    author = relationship("Author", back_populates="tweets", lazy="raise_on_sql")
 
 
 class Author(Base):
     __tablename__ = "author"
 
+    __table_args__ = (
+        Index(
+            "ix_author_created_at_brin",
+            "created_at",
+            postgresql_using="brin",
+            postgresql_with={"pages_per_range": 32},
+        ),
+    )
+
     id = Column(
-        String(256),
+        BigInteger,
         primary_key=True,
         nullable=False,
         unique=True,
@@ -115,20 +190,15 @@ class Author(Base):
     tweet_count = Column(Integer, doc="The number of tweets of the author")
     listed_count = Column(Integer, doc="The number of lists the author is in")
 
-    @property
-    def clean_text(self):
-        """
-        Remove newlines from the tweet text.
-        """
-        if self.description:
-            self.description = self.description.replace("\x00", "\uFFFD")
+    # raise instead of emitting a query per author, load with selectinload
+    tweets = relationship("Tweet", back_populates="author", lazy="raise_on_sql")
 
 
 class Retweet_Tweet_Mapping(Base):
     __tablename__ = "retweeted_tweet_mapping"
 
     id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
         primary_key=True,
@@ -137,9 +207,10 @@ class Retweet_Tweet_Mapping(Base):
     )
 
     tweet_id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
+        index=True,
         doc="The unique identifier of the tweet being retweeted",
     )
 
@@ -148,7 +219,7 @@ class Quoted_Tweet_Mapping(Base):
     __tablename__ = "quoted_tweet_mapping"
 
     id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
         primary_key=True,
@@ -156,9 +227,10 @@ class Quoted_Tweet_Mapping(Base):
     )
 
     tweet_id = Column(
-        String(256),
+        BigInteger,
         # ForeignKey("tweet.id"), contains deleted tweets
         nullable=False,
+        index=True,
         doc="The unique identifier of the tweet being quoted",
     )
 
@@ -167,7 +239,7 @@ class Replied_Tweet_Mapping(Base):
     __tablename__ = "replied_to_tweet_mapping"
 
     id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
         primary_key=True,
@@ -175,16 +247,18 @@ class Replied_Tweet_Mapping(Base):
     )
 
     tweet_id = Column(
-        String(256),
+        BigInteger,
         # ForeignKey("tweet.id"), # contains deleted tweets
         nullable=False,
+        index=True,
         doc="The unique identifier of the tweet being replied to",
     )
 
     in_reply_to_user_id = Column(
-        String(256),
+        BigInteger,
         # ForeignKey("author.id"), #contains deleted/suspended users
         nullable=False,
+        index=True,
         doc="The unique identifier of the user being replied to",
     )
 
@@ -192,22 +266,15 @@ class Replied_Tweet_Mapping(Base):
 class Hastag_Tweet_Mapping(Base):
     __tablename__ = "hashtags_tweet_mapping"
 
-    table_args = (UniqueConstraint("tweet_id", "start", name="unique_hashtag_tweet"),)
-
-    # AutoIncrement Id:
-    id = Column(
-        Integer,
-        primary_key=True,
-        nullable=False,
-        unique=True,
-        autoincrement=True,
-        doc="The unique identifier of the hastag",
+    __table_args__ = (
+        Index("ix_hashtags_tweet_mapping_tweet_id_tag", "tweet_id", "tag"),
     )
 
     tweet_id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
+        primary_key=True,
         doc="The unique identifier of the tweet",
         onupdate="CASCADE",
     )
@@ -220,11 +287,13 @@ class Hastag_Tweet_Mapping(Base):
     start = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="start index of the hashtag in the tweet",
     )
     end = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="end index of the hashtag in the tweet",
     )
 
@@ -232,22 +301,15 @@ class Hastag_Tweet_Mapping(Base):
 class Castag_Tweet_Mapping(Base):
     __tablename__ = "cashtags_tweet_mapping"
 
-    table_args = (UniqueConstraint("tweet_id", "start", name="unique_cashtag_tweet"),)
-
-    # AutoIncrement Id:
-    id = Column(
-        Integer,
-        primary_key=True,
-        nullable=False,
-        unique=True,
-        autoincrement=True,
-        doc="The unique identifier of the castag",
+    __table_args__ = (
+        Index("ix_cashtags_tweet_mapping_tweet_id_tag", "tweet_id", "tag"),
     )
 
     tweet_id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
+        primary_key=True,
         doc="The unique identifier of the tweet",
         onupdate="CASCADE",
     )
@@ -260,11 +322,13 @@ class Castag_Tweet_Mapping(Base):
     start = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="start index of the cashtag in the tweet",
     )
     end = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="end index of the cashtag in the tweet",
     )
 
@@ -272,22 +336,11 @@ class Castag_Tweet_Mapping(Base):
 class Url_Tweet_Mapping(Base):
     __tablename__ = "urls_tweet_mapping"
 
-    table_args = (UniqueConstraint("tweet_id", "start", name="unique_url_tweet"),)
-
-    # AutoIncrement Id:
-    id = Column(
-        Integer,
-        primary_key=True,
-        nullable=False,
-        unique=True,
-        autoincrement=True,
-        doc="The unique identifier of the url",
-    )
-
     tweet_id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
+        primary_key=True,
         doc="The unique identifier of the tweet",
         onupdate="CASCADE",
     )
@@ -300,11 +353,13 @@ class Url_Tweet_Mapping(Base):
     start = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="start index of the url in the tweet",
     )
     end = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="end index of the url in the tweet",
     )
     expanded_url = Column(
@@ -327,22 +382,15 @@ class Url_Tweet_Mapping(Base):
 class Mention_Tweet_Mapping(Base):
     __tablename__ = "mentions_tweet_mapping"
 
-    table_args = (UniqueConstraint("tweet_id", "start", name="unique_mention_tweet"),)
-
-    # AutoIncrement Id:
-    id = Column(
-        Integer,
-        primary_key=True,
-        nullable=False,
-        unique=True,
-        autoincrement=True,
-        doc="The unique identifier of the mention",
+    __table_args__ = (
+        Index("ix_mentions_tweet_mapping_tweet_id_username", "tweet_id", "username"),
     )
 
     tweet_id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
+        primary_key=True,
         doc="The unique identifier of the tweet",
         onupdate="CASCADE",
     )
@@ -355,17 +403,20 @@ class Mention_Tweet_Mapping(Base):
     start = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="start index of the username in the tweet",
     )
     end = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="end index of the username in the tweet",
     )
     author_id = Column(
-        String(256),
+        BigInteger,
         # ForeignKey("author.id"),
         nullable=False,
+        index=True,
         doc="id of the user mentioned in the tweet",
     )
 
@@ -373,23 +424,11 @@ class Mention_Tweet_Mapping(Base):
 class Annonation_Tweet_Mapping(Base):
     __tablename__ = "annotations_tweet_mapping"
 
-    table_args = (
-        UniqueConstraint("tweet_id", "start", name="unique_annotation_tweet"),
-    )
-
-    id = Column(
-        Integer,
-        primary_key=True,
-        nullable=False,
-        unique=True,
-        autoincrement=True,
-        doc="The unique identifier of the annotation",
-    )
-
     tweet_id = Column(
-        String(256),
+        BigInteger,
         ForeignKey("tweet.id"),
         nullable=False,
+        primary_key=True,
         doc="The unique identifier of the tweet",
         onupdate="CASCADE",
     )
@@ -397,11 +436,13 @@ class Annonation_Tweet_Mapping(Base):
     start = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="start index of the annotation in the tweet",
     )
     end = Column(
         Integer,
         nullable=False,
+        primary_key=True,
         doc="end index of the annotation in the tweet",
     )
     probability = Column(
@@ -411,9 +452,9 @@ class Annonation_Tweet_Mapping(Base):
     )
 
     type = Column(
-        String(256),
+        SmallInteger,
         nullable=False,
-        doc="type of the annotation in the tweet",
+        doc="type of the annotation in the tweet, see AnnotationType",
     )
 
     normalized_text = Column(
@@ -421,3 +462,150 @@ class Annonation_Tweet_Mapping(Base):
         nullable=False,
         doc="normalized text of the annotation in the tweet",
     )
+
+
+def _stage_table(target: Table) -> Table:
+    """
+    Create an UNLOGGED staging table with the columns of a table.
+
+    Rows are copied into the staging table, moved into the target table
+    with INSERT ... SELECT ... ON CONFLICT DO NOTHING and truncated. As the
+    staging table is UNLOGGED its writes skip the write-ahead log; it has
+    no keys or constraints to check.
+
+    Parameters
+    ----------
+    target : Table
+        the table the rows are staged for
+
+    Returns
+    -------
+    Table
+        the staging table, named after the target with a _stage suffix
+    """
+    return Table(
+        f"{target.name}_stage",
+        Base.metadata,
+        *(Column(column.name, column.type) for column in target.columns),
+        prefixes=["UNLOGGED"],
+    )
+
+
+# The staging tables of the tables loaded from files, by target table name
+STAGE_TABLES = {
+    model.__table__.name: _stage_table(model.__table__)
+    for model in (
+        Author,
+        Tweet,
+        Retweet_Tweet_Mapping,
+        Quoted_Tweet_Mapping,
+        Replied_Tweet_Mapping,
+        Mention_Tweet_Mapping,
+        Url_Tweet_Mapping,
+        Hastag_Tweet_Mapping,
+        Annonation_Tweet_Mapping,
+        Castag_Tweet_Mapping,
+    )
+}
+
+# The entity kinds of the tweet_entity view
+ENTITY_KINDS = {
+    "mentions": 1,
+    "urls": 2,
+    "hashtags": 3,
+    "annotations": 4,
+    "cashtags": 5,
+}
+
+# A single view over the entity mapping tables, so that all entities of a tweet
+# can be fetched with one query. Fields that only exist for some of the
+# entities are kept in the extra column.
+tweet_entity = table(
+    "tweet_entity",
+    column("tweet_id", BigInteger),
+    column("kind", SmallInteger),
+    column("start", Integer),
+    column("end", Integer),
+    column("value", Text),
+    column("extra", JSONB),
+)
+
+_tweet_entity_selects = [
+    (
+        "mentions_tweet_mapping",
+        "username",
+        "jsonb_build_object('author_id', author_id)",
+    ),
+    (
+        "urls_tweet_mapping",
+        "url",
+        "jsonb_build_object('expanded_url', expanded_url, "
+        "'display_url', display_url, 'media_key', media_key)",
+    ),
+    ("hashtags_tweet_mapping", "tag", "NULL::jsonb"),
+    (
+        "annotations_tweet_mapping",
+        "normalized_text",
+        "jsonb_build_object('probability', probability, 'type', type)",
+    ),
+    ("cashtags_tweet_mapping", "tag", "NULL::jsonb"),
+]
+
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        "CREATE OR REPLACE VIEW tweet_entity AS "
+        + " UNION ALL ".join(
+            f"SELECT tweet_id, "
+            f"CAST({ENTITY_KINDS[name.split('_')[0]]} AS SMALLINT) AS kind, "
+            f'start, "end", CAST({value} AS TEXT) AS value, {extra} AS extra '
+            f"FROM {name}"
+            for name, value, extra in _tweet_entity_selects
+        )
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    Base.metadata,
+    "before_drop",
+    DDL("DROP VIEW IF EXISTS tweet_entity").execute_if(dialect="postgresql"),
+)
+
+# Number of tweets per hashtag and day, refreshed after each upload with
+# REFRESH MATERIALIZED VIEW CONCURRENTLY, which needs the unique index.
+tweet_hashtag_daily = table(
+    "tweet_hashtag_daily",
+    column("day", DateTime),
+    column("tag", String),
+    column("tweet_count", BigInteger),
+)
+
+# The materialized views to refresh after the tables are updated
+MATERIALIZED_VIEWS = ["tweet_hashtag_daily"]
+
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS tweet_hashtag_daily AS "
+        "SELECT date_trunc('day', t.created_at) AS day, h.tag, "
+        "COUNT(*) AS tweet_count "
+        "FROM tweet t JOIN hashtags_tweet_mapping h ON h.tweet_id = t.id "
+        "GROUP BY 1, 2"
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_tweet_hashtag_daily_day_tag "
+        "ON tweet_hashtag_daily (day, tag)"
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    Base.metadata,
+    "before_drop",
+    DDL("DROP MATERIALIZED VIEW IF EXISTS tweet_hashtag_daily").execute_if(
+        dialect="postgresql"
+    ),
+)
@@ -6,22 +6,6 @@ import sqlalchemy as sa
 from twarc2sql.db_utils import db_access
 
 
-# create a fixture that returns a engine:
-@pytest.fixture(scope="module")
-def config_file_path() -> str:
-    """
-    config_file_path _summary_.
-
-    returns a path to a .env file
-
-    Returns
-    -------
-    str
-        path to a .env file
-    """
-    return "tests/data/.testenv"
-
-
 @pytest.fixture(scope="module")
 def uri(config_file_path):
     """
@@ -74,54 +58,23 @@ def base_tables():
 
 # create a fixture that returns a tables & columns dict:
 @pytest.fixture(scope="module")
-def tables_and_columns() -> dict:
+def tables_and_columns(base_tables) -> dict:
     """
     tables_and_columns _summary_.
 
-    returns a dict of tables and columns
+    returns a dict of tables and columns, taken from the models
+
+    Parameters
+    ----------
+    base_tables : sqlalchemy.orm.DeclarativeMeta
+        Base class of the models
 
     Returns
     -------
     dict
         dict of tables and columns
     """
-    # TODO: add more tables and columns
-    table_columns = {
-        "tweet": [
-            "id",
-            "created_at",
-            "text",
-            "possibly_sensitive",
-            "conversation_id",
-            "author_id",
-            "reply_settings",
-            "lang",
-            "in_reply_to_user_id",
-            "tweet_type",
-            "retweet_count",
-            "reply_count",
-            "like_count",
-            "quote_count",
-            "impression_count",
-            # "edits_remaining",
-            # "is_edit_eligible",
-            # "editable_until",
-        ],
-        "author": [
-            "id",
-            "name",
-            "username",
-            "created_at",
-            "description",
-            "location",
-            "verified",
-            "protected",
-            "url",
-            "profile_image_url",
-            "followers_count",
-            "following_count",
-            "tweet_count",
-            "listed_count",
-        ],
+    return {
+        table.name: [column.name for column in table.columns]
+        for table in base_tables.metadata.sorted_tables
     }
-    return table_columns
@@ -1,14 +1,39 @@
 """Module for file utilities for twarc2sql."""
 
-objects = {
-    "tweets_object": [],
-    "users_object": [],
-    "media_object": [],
-    "places_object": [],
-    "polls_object": [],
-    "meta_object": [],
-    "error_info_object": [],
-}
+from typing import Any, Dict, Iterable, List
+
+# The objects collected from each response of the twitter API
+OBJECT_KEYS = (
+    "tweets_object",
+    "users_object",
+    "media_object",
+    "places_object",
+    "polls_object",
+    "meta_object",
+    "error_info_object",
+)
+
+
+def make_objects(keys: Iterable[str] = OBJECT_KEYS) -> Dict[str, Dict[str, List[Any]]]:
+    """
+    make_objects creates empty buffers for the objects of a chunk.
+
+    Each object is accumulated column-wise, as a dict of column name to
+    values. Every call returns new buffers, so callers (e.g. worker
+    processes) never share them.
+
+    Parameters
+    ----------
+    keys : Iterable[str], optional
+        the names of the objects, by default OBJECT_KEYS
+
+    Returns
+    -------
+    Dict[str, Dict[str, List[Any]]]
+        an empty dict of columns for each object
+    """
+    return {key: {} for key in keys}
+
 
 object_columns = {
     "tweet_object": [
@@ -95,6 +120,45 @@ object_columns = {
     ],
 }
 
+# the columns of each object as sets, built once for validation
+object_column_sets = {
+    object_type: frozenset(columns) for object_type, columns in object_columns.items()
+}
+
+# The keys of the dict columns that are expanded into their own columns, by
+# object type and column, so they need not be read from the data
+dict_column_keys = {
+    "tweet_object": {
+        "public_metrics": [
+            "retweet_count",
+            "reply_count",
+            "like_count",
+            "quote_count",
+            "impression_count",
+        ],
+        "edit_controls": [
+            "edits_remaining",
+            "is_edit_eligible",
+            "editable_until",
+        ],
+    },
+    "user_object": {
+        "public_metrics": [
+            "followers_count",
+            "following_count",
+            "tweet_count",
+            "listed_count",
+        ],
+    },
+    "entities": {
+        "mentions": ["start", "end", "username", "id"],
+        "urls": ["start", "end", "url", "expanded_url", "display_url"],
+        "hashtags": ["start", "end", "tag"],
+        "annotations": ["start", "end", "probability", "type", "normalized_text"],
+        "cashtags": ["start", "end", "tag"],
+    },
+}
+
 # TODO: Use this to assign names for the tables
 # TODO: Use this to prioritize the order of the tables when creating the database
 table_columns = {
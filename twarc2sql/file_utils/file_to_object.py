@@ -4,38 +4,150 @@ This module contains functions to convert a file to objects to
 be processed for each endpoint.
 """
 
-from typing import Any, Dict, List
+import json
+from typing import IO, Any, Dict, Iterator, List, Optional
 
-import pandas as pd
+# Column names of the meta keys, e.g. "url" -> "twarc_meta_url", built once per key
+_meta_column_names: Dict[str, str] = {}
 
 
-def add_meta_info(x: Dict[str, Any], twarc_meta: Dict[str, Any]) -> pd.DataFrame:
+def meta_columns(twarc_meta: Dict[str, Any]) -> Dict[str, Any]:
     """
-    add_meta_info is converts dict to df and adds meta information.
+    meta_columns prefixes the keys of the meta information.
 
-    a function that takes a dictionary of data and a dictionary of meta information
-    and returns a dataframe with the meta information added to the data.
+    The prefixed column names are cached, so they are built once per key
+    instead of once per response.
 
     Parameters
     ----------
-    x : Dict[str, Any]
-        The dictionary of data
     twarc_meta : Dict[str, Any]
         The dictionary of meta information
+
+    Returns
+    -------
+    Dict[str, Any]
+        The meta information keyed by column name
+    """
+    columns = {}
+    for key, value in twarc_meta.items():
+        name = _meta_column_names.get(key)
+        if name is None:
+            name = _meta_column_names[key] = "twarc_meta_" + key
+        columns[name] = value
+    return columns
+
+
+def add_meta_info(
+    x: Optional[List[Dict[str, Any]]],
+    twarc_meta: Dict[str, Any],
+    meta_column_values: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    add_meta_info adds meta information to records.
+
+    a function that takes a list of records and a dictionary of meta information
+    and returns the records with the meta information added to each of them.
+
+    The records are appended column-wise to the object, the dataframe of an
+    object is built once from the columns of a whole chunk.
+
+    Parameters
+    ----------
+    x : Optional[List[Dict[str, Any]]]
+        The records of data, None if the object is missing
+    twarc_meta : Dict[str, Any]
+        The dictionary of meta information
+    meta_column_values : Optional[Dict[str, Any]], optional
+        The meta information already keyed by column name, see meta_columns.
+        Computed from twarc_meta if None, by default None
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The records with the meta information added
+    """
+    if not x:
+        return []
+    if meta_column_values is None:
+        meta_column_values = meta_columns(twarc_meta)
+    return [{**record, **meta_column_values} for record in x]
+
+
+def read_json_chunks(file: IO[bytes], chunksize: int) -> Iterator[List[Dict[str, Any]]]:
+    """
+    read_json_chunks reads a jsonl file in chunks of parsed lines.
+
+    The file is read in a single pass, each line is parsed with json.loads
+    into a dict. Empty lines are skipped.
+
+    Parameters
+    ----------
+    file : IO[bytes]
+        The jsonl file, opened in binary mode
+    chunksize : int
+        The number of lines per chunk
+
+    Yields
+    ------
+    List[Dict[str, Any]]
+        The parsed lines of a chunk; the last chunk may be shorter
+    """
+    chunk = []
+    for line in file:
+        if not line.strip():
+            continue
+        chunk.append(json.loads(line))
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def append_records(
+    columns: Dict[str, List[Any]], records: List[Dict[str, Any]]
+) -> Dict[str, List[Any]]:
+    """
+    append_records appends records to column-oriented storage.
+
+    The values of each record are appended to the list of their column. A
+    column first seen in a later record is filled with None for the earlier
+    rows, and columns missing from a record get None, so all columns keep
+    the same length.
+
+    Parameters
+    ----------
+    columns : Dict[str, List[Any]]
+        The values of each column
+    records : List[Dict[str, Any]]
+        The records to append
+
+    Returns
+    -------
+    Dict[str, List[Any]]
+        The columns with the records appended
     """
-    x = pd.DataFrame(x)
-    for key in twarc_meta:
-        x["twarc_meta_" + key] = twarc_meta[key]
-    return x
+    n_rows = len(next(iter(columns.values()), []))
+    for record in records:
+        for key, value in record.items():
+            if key not in columns:
+                columns[key] = [None] * n_rows
+            columns[key].append(value)
+        n_rows += 1
+        if len(record) < len(columns):
+            for values in columns.values():
+                if len(values) < n_rows:
+                    values.append(None)
+    return columns
 
 
 def get_object_for_search(
-    chunk: pd.DataFrame, objects: Dict[str, List[pd.DataFrame]]
-) -> Dict[str, List[pd.DataFrame]]:
+    chunk: List[Dict[str, Any]], objects: Dict[str, Dict[str, List[Any]]]
+) -> Dict[str, Dict[str, List[Any]]]:
     """
-    get_object_for_search converts df to objects.
+    get_object_for_search converts a chunk of responses to objects.
 
-    The function takes a chunk of a dataframe and returns a dictionary of
+    The function takes a chunk of parsed jsonl lines and returns a dictionary of
     objects to be processed for the search endpoint.
 
     The potential objects are:
@@ -48,29 +160,34 @@ def get_object_for_search(
 
     Parameters
     ----------
-    chunk : pd.DataFrame
-        The chunk of the dataframe to be processed
-    objects : Dict[str, List[pd.DataFrame]]
-        The dictionary of objects to be returned
+    chunk : List[Dict[str, Any]]
+        The chunk of parsed lines to be processed
+    objects : Dict[str, Dict[str, List[Any]]]
+        The dictionary of object columns to be returned
 
     Returns
     -------
-    objects : Dict[str, List[pd.DataFrame]]
-        The dictionary of objects with the new objects added
+    objects : Dict[str, Dict[str, List[Any]]]
+        The dictionary of object columns with the new records added
     """
-    objects["tweets_object"] += chunk.apply(
-        lambda x: add_meta_info(x["data"], x["__twarc"]), axis=1
-    ).tolist()
     includes = ["users", "tweets", "media", "places", "polls"]
-    for include in includes:
-        objects[f"{include}_object"] += chunk.apply(
-            lambda x: add_meta_info(x["includes"].get(include), x["__twarc"]), axis=1
-        ).tolist()
-
-    objects["error_info_object"] += (
-        chunk.dropna(subset=["errors"])
-        .apply(lambda x: add_meta_info(x["errors"], x["__twarc"]), axis=1)
-        .tolist()
-    )
-    objects["meta_object"] += chunk["__twarc"].tolist()
+    for response in chunk:
+        meta = response["__twarc"]
+        # the meta columns are shared by all objects of the response
+        values = meta_columns(meta)
+        append_records(
+            objects["tweets_object"], add_meta_info(response["data"], meta, values)
+        )
+        response_includes = response.get("includes", {})
+        for include in includes:
+            append_records(
+                objects[f"{include}_object"],
+                add_meta_info(response_includes.get(include), meta, values),
+            )
+        if response.get("errors") is not None:
+            append_records(
+                objects["error_info_object"],
+                add_meta_info(response["errors"], meta, values),
+            )
+        append_records(objects["meta_object"], [meta])
     return objects
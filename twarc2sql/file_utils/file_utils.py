@@ -1,16 +1,31 @@
 """file_utils contains functions to read files and upload them to the database."""
 
-from typing import Any, Dict
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
 
 import pandas as pd
-from sqlalchemy.dialects.postgresql import insert
-
-from twarc2sql.db_utils.db_access import create_db_with_tables, get_engine
-
-from . import objects
-from .file_to_object import get_object_for_search
+import sqlalchemy as sa
+
+from twarc2sql.db_utils.db_access import (
+    DatabaseException,
+    bulk_load_context,
+    copy_rows,
+    create_db_with_tables,
+    get_engine,
+    refresh_materialized_views,
+)
+from twarc2sql.db_utils.models import Base
+
+from . import OBJECT_KEYS, make_objects
+from .file_to_object import get_object_for_search, read_json_chunks
 from .object_to_table import tweet_object_to_table, user_object_to_table
 
+logger = logging.getLogger(__name__)
+
 table_priority = [
     "meta",
     "author",
@@ -29,48 +44,168 @@ table_priority = [
     "errors",
 ]
 
+# the integer columns of each table; pandas holds integer columns with missing
+# values as float64, which COPY would receive as e.g. "10.0" and reject
+integer_columns = {
+    table.name: frozenset(
+        column.name for column in table.columns if isinstance(column.type, sa.Integer)
+    )
+    for table in Base.metadata.sorted_tables
+}
+
 
-def upload_to_database(tables: Dict[str, pd.DataFrame], engine: Any) -> None:
+def drop_duplicate_rows(table: str, data: pd.DataFrame) -> pd.DataFrame:
+    """
+    drop_duplicate_rows drops the rows of a chunk that repeat a primary key.
+
+    Only the primary key columns are compared, not whole rows. The first row
+    with a key is kept, the row that ON CONFLICT DO NOTHING would keep as
+    well. Rows uploaded by earlier chunks are not tracked here, the
+    conflict skip of the load drops them, so no keys are kept in memory
+    between chunks.
+
+    Parameters
+    ----------
+    table : str
+        the name of the table, its primary key is taken from the models
+    data : pd.DataFrame
+        the rows of the table
+
+    Returns
+    -------
+    pd.DataFrame
+        the rows with a primary key that is not repeated
+    """
+    key_columns = [column.name for column in Base.metadata.tables[table].primary_key]
+    return data.drop_duplicates(subset=key_columns)
+
+
+def upload_to_database(
+    tables: Dict[str, pd.DataFrame],
+    engine: Union[sa.engine.base.Engine, sa.engine.Connection],
+) -> None:
     """
     upload_to_database uploads the tables to the database.
 
+    All tables are uploaded on one connection in a single transaction, so a
+    chunk is either uploaded completely or not at all. With a connection the
+    tables are uploaded in the transaction of the caller. The rows are loaded
+    with COPY through a staging table, rows already in the database are
+    skipped.
+
     Parameters
     ----------
     tables : Dict[str, pd.DataFrame]
         the tables to upload to the database
 
-    engine : Any
-        the engine to connect to the database
+    engine : Union[sa.engine.base.Engine, sa.engine.Connection]
+        the engine or connection for the database
+    """
+    if isinstance(engine, sa.engine.Connection):
+        transaction = nullcontext(engine)
+    else:
+        transaction = engine.begin()
+    with transaction as connection:
+        for table in table_priority:
+            # empty frames are skipped, e.g. when no tweet of the chunk has cashtags
+            frames = [frame for frame in tables[table] if not frame.empty]
+            if frames:
+                # a chunk usually adds a single frame per table, it needs no concat
+                current_table = frames[0] if len(frames) == 1 else pd.concat(frames)
+                current_table = drop_duplicate_rows(table, current_table)
+                logger.debug("Uploading %s rows to %s", len(current_table), table)
+
+                float_columns = {
+                    column: "Int64"
+                    for column in integer_columns[table].intersection(
+                        current_table.columns
+                    )
+                    if current_table[column].dtype.kind == "f"
+                }
+                if float_columns:
+                    current_table = current_table.astype(float_columns)
+
+                # COPY sends missing values as NULL only if they are None; the
+                # rows are zipped from the columns, without an object copy of
+                # the whole frame
+                columns = [
+                    current_table[column].to_numpy(dtype=object, na_value=None)
+                    for column in current_table.columns
+                ]
+                copy_rows(
+                    connection,
+                    table,
+                    zip(*columns),
+                    list(current_table.columns),
+                    skip_duplicates=True,
+                )
+
+
+task_types = {"search": get_object_for_search}
+
+
+def process_chunk(
+    chunk: List[Dict[str, Any]],
+    task_type: str,
+    current_objects: Dict[str, Dict[str, List[Any]]],
+    tables: Optional[Dict[str, List[pd.DataFrame]]] = None,
+) -> Dict[str, List[pd.DataFrame]]:
+    """
+    process_chunk converts a chunk of responses to the tables to upload.
+
+    The function does not touch the database, so chunks can be processed in
+    worker processes while the main process uploads.
+
+    Parameters
+    ----------
+    chunk : List[Dict[str, Any]]
+        the parsed lines of the chunk
+    task_type : str
+        the type of task that was run
+    current_objects : Dict[str, Dict[str, List[Any]]]
+        empty column buffers for each object
+    tables : Optional[Dict[str, List[pd.DataFrame]]], optional
+        empty table buffers to fill, new ones are created if None,
+        by default None
+
+    Returns
+    -------
+    Dict[str, List[pd.DataFrame]]
+        the tables of the chunk
     """
-    for table in table_priority:
-        current_table = tables[table]
-        if len(current_table) > 0:
-            current_table = pd.concat(current_table)
-            current_table = current_table.drop_duplicates()
-            print(f"Uploading {len(current_table)} rows to {table}")
-
-            current_table.to_sql(
-                table,
-                engine,
-                if_exists="append",
-                index=False,
-                method=on_duplicate_do_nothing,
-            )
+    if tables is None:
+        tables = {table: [] for table in table_priority}
+    # get objects from chunk:
+    task_types[task_type](chunk, current_objects)
+    # TODO:Object processing is task specific i.e diff for tasks
+    # convert objects to tables:
+    # one dataframe per object, built from the columns of the whole chunk
+    tweet_object = pd.DataFrame(current_objects["tweets_object"])
+    tweet_object_to_table(tweet_object, tables)
+    user_object = pd.DataFrame(current_objects["users_object"])
+    user_object_to_table(user_object, tables)
+    return tables
 
 
 def read_and_upload_file(
-    folder_path: str,
+    folder_path: Union[str, Path],
     file_name: str,
     task_type: str = "search",
     engine: Any = None,
-    objects: Dict[str, Any] = {},
+    objects: Optional[Iterable[str]] = None,
+    max_workers: int = 1,
+    chunksize: int = 100,
 ) -> Dict[str, Any]:
     """
     read_and_upload_file reads the file and uploads it to the database.
 
+    With more than one worker, the chunks are processed in a pool of worker
+    processes while the main process reads the file and uploads the finished
+    chunks in file order. At most two chunks per worker are in flight.
+
     Parameters
     ----------
-    folder_path : str
+    folder_path : Union[str, Path]
         the folder path where the file is located
 
     file_name : str
@@ -80,99 +215,143 @@ def read_and_upload_file(
         the type of task that was run, by default "search"
 
     engine : Any, optional
-        the engine to connect to the database, by default None
+        the engine or connection for the database, with a connection the
+        chunks are uploaded in the transaction of the caller, by default None
 
-    objects : Dict[str, Any], optional
-        the objects to upload to the database, by default {}
+    objects : Optional[Iterable[str]], optional
+        the names of the objects to collect from the responses,
+        by default None (all of OBJECT_KEYS)
+
+    max_workers : int, optional
+        the number of processes that process chunks, by default 1
+        (the chunks are processed in the main process)
+
+    chunksize : int, optional
+        the number of lines (API responses) converted to tables and uploaded
+        together; larger chunks spread the pandas overhead over more rows,
+        by default 100
 
     Returns
     -------
     Dict[str, Any]
         the objects to uploaded to the database
 
+    Raises
+    ------
+    FileNotFoundError
+        if the file does not exist
+
     """
-    # read the file in chunks:
-    file_path: str = folder_path + file_name
-    chunksize = 100
-    chunks = pd.read_json(file_path, lines=True, chunksize=chunksize)
-
-    task_types = {"search": get_object_for_search}
-
-    # Number of lines in the file:
-    num_lines = sum(1 for line in open(file_path))
-    num_chunks = num_lines / chunksize
-    i = 0
-
-    for chunk in chunks:
-        print(f"Processing chunk {i} of {num_chunks}")
-        i += 1
-        # create empty tables for each chunk:
-        tables = {table: [] for table in table_priority}
-        # get objects from chunk:
-        current_objects = {key: [] for key in objects.keys()}
-        current_objects = task_types[task_type](chunk, current_objects)
-        # TODO:Object processing is task specific i.e diff for tasks
-        # convert objects to tables:
-        current_objects["tweets_object"] = pd.concat(current_objects["tweets_object"])
-        tables = tweet_object_to_table(current_objects["tweets_object"], tables)
-        current_objects["users_object"] = pd.concat(current_objects["users_object"])
-        tables = user_object_to_table(current_objects["users_object"], tables)
-        # upload tables to database:
-        upload_to_database(tables, engine)
+    # read the file in chunks, in a single pass:
+    file_path = Path(folder_path) / file_name
+    # stat raises FileNotFoundError if the file does not exist
+    file_size = file_path.stat().st_size
+
+    # table buffers reused by every chunk, emptied at the start of each chunk
+    tables = {table: [] for table in table_priority}
+    object_keys = OBJECT_KEYS if objects is None else tuple(objects)
+
+    with open(file_path, "rb") as file:
+        chunks = read_json_chunks(file, chunksize)
+        if max_workers <= 1:
+            for i, chunk in enumerate(chunks):
+                logger.debug(
+                    "Processing chunk %s of %s (%s of %s bytes read)",
+                    i,
+                    file_name,
+                    file.tell(),
+                    file_size,
+                )
+                for table in tables.values():
+                    table.clear()
+                # the object columns of a chunk depend on its records, so
+                # every chunk starts from empty objects
+                current_objects = make_objects(object_keys)
+                process_chunk(chunk, task_type, current_objects, tables)
+                # upload tables to database:
+                upload_to_database(tables, engine)
+            return tables
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for i, chunk in enumerate(chunks):
+                logger.debug(
+                    "Processing chunk %s of %s (%s of %s bytes read)",
+                    i,
+                    file_name,
+                    file.tell(),
+                    file_size,
+                )
+                # each worker fills its own buffers and returns its own tables
+                pending.append(
+                    executor.submit(
+                        process_chunk,
+                        chunk,
+                        task_type,
+                        make_objects(object_keys),
+                    )
+                )
+                if len(pending) >= 2 * max_workers:
+                    tables = pending.popleft().result()
+                    upload_to_database(tables, engine)
+            while pending:
+                tables = pending.popleft().result()
+                upload_to_database(tables, engine)
 
     return tables
 
 
-# TODO: this function should be moved to the db_utils folder
-def on_duplicate_do_nothing(table, conn, keys, data_iter) -> None:
-    """on_duplicate_do_nothing uploads data to the database without duplicates.
-
-    This function is used to upload data to the database when it encounters duplicates
-    it does not upload the data & does not throw an error.
-
-    Parameters
-    ----------
-    table : Any
-        the table to upload the data to
-
-    conn : Any
-        the connection to the database
-
-    keys : Any
-        the keys to use to check for duplicates
-
-    data_iter : Any
-        the data to upload to the database
-
-    """
-    insert_stmt = insert(table.table).values(list(data_iter))
-    on_duplicate_key_stmt = insert_stmt.on_conflict_do_nothing()
-    conn.execute(on_duplicate_key_stmt)
-
-
 def connect_to_db_and_upload(
-    folder_path: str,
+    folder_path: Union[str, Path],
     file_name: str,
     task_type: str = "search",
-    config_file_path: str = None,
-) -> None:
+    config_file_path: Optional[str] = None,
+    bulk_load: bool = False,
+    max_workers: int = 1,
+    chunksize: int = 100,
+) -> Dict[str, Any]:
     """
     connect_to_db_and_upload connects to the db and uploads the file to the db.
 
     Parameters
     ----------
-    folder_path : str
+    folder_path : Union[str, Path]
         the folder path where the file is located
     file_name : str
         the name of the file
     task_type : str, optional
         the type of task that was run, by default "search"
+    config_file_path : Optional[str], optional
+        Path to the .env file. If None, defaults to .env in the current directory,
+        by default None
+    bulk_load : bool, optional
+        drop the foreign keys during the upload and validate them afterwards,
+        faster for initial imports, by default False
+    max_workers : int, optional
+        the number of processes that process chunks, by default 1
+    chunksize : int, optional
+        the number of lines uploaded together, by default 100
+
+    Returns
+    -------
+    Dict[str, Any]
+        the tables of the last chunk uploaded to the database, as returned by
+        read_and_upload_file
     """
     try:
         engine = get_engine(config_file_path)
-    except Exception as e:
-        print(e)
-        print("Creating database")
+    except DatabaseException as e:
+        # any other error (e.g. the server is unreachable) is raised unchanged
+        logger.info("%s, creating database", e)
         engine = create_db_with_tables(config_file_path)
-    tables = read_and_upload_file(folder_path, file_name, task_type, engine, objects)
+    with bulk_load_context(engine) if bulk_load else nullcontext():
+        tables = read_and_upload_file(
+            folder_path,
+            file_name,
+            task_type,
+            engine,
+            max_workers=max_workers,
+            chunksize=chunksize,
+        )
+    refresh_materialized_views(engine)
     return tables
@@ -1,10 +1,34 @@
 """Functions to process objects from the twitter API and convert them to tables."""
 
+from operator import itemgetter
 from typing import Dict, List, Optional
 
+import numpy as np
 import pandas as pd
 
-from . import object_columns, table_columns
+from twarc2sql.db_utils.models import AnnotationType, sanitize_text
+
+from . import dict_column_keys, object_column_sets, object_columns, table_columns
+
+# The codes of the annotation types, keyed by upper-case type name
+_annotation_type_codes = {member.name: member.value for member in AnnotationType}
+
+# The tweet_type code of each combination of reference types, indexed by its
+# bit mask (quoted 1, retweeted 2, replied_to 4). A tweet with a retweeted
+# reference is stored as a retweet (2), whatever its other references.
+_tweet_type_codes = np.array(
+    [
+        0,  # no reference: original
+        1,  # quoted
+        2,  # retweeted
+        2,  # retweeted + quoted
+        3,  # replied_to
+        4,  # replied_to + quoted
+        2,  # retweeted + replied_to
+        2,  # retweeted + quoted + replied_to
+    ],
+    dtype=np.int8,
+)
 
 
 def expand_dict_column(
@@ -15,6 +39,9 @@ def expand_dict_column(
 
     This function converts a column that contains a dictionary
     into multiple columns. The keys of the dictionary are used.
+    All columns are built in one pass over the dictionaries; keys missing
+    from a dictionary, and rows without a dictionary, are missing values.
+    data is not modified, a new frame with the expanded columns is returned.
 
     Parameters
     ----------
@@ -23,20 +50,120 @@ def expand_dict_column(
     column : str
         the column to expand
     keys : Optional[List]
-        the keys to expand. If None, the keys are taken from
-        the first row of the column.
+        the keys to expand, see dict_column_keys for the known columns.
+        If None, the keys are taken from the first dict of the column.
 
     Returns
     -------
-    data : pd.DataFrame
-        the data with the expanded column
+    pd.DataFrame
+        a new frame, the data with the expanded column
+
+    Raises
+    ------
+    ValueError
+        if keys is None and the column contains no dict to take them from
 
     """
     if keys is None:
-        keys = data[column].dropna().iloc[0].keys()
+        first = next((value for value in data[column] if isinstance(value, dict)), None)
+        if first is None:
+            raise ValueError(f"column {column} has no dict to take the keys from")
+        keys = first.keys()
+    keys = list(keys)
+
+    records = [value if isinstance(value, dict) else {} for value in data[column]]
+    expanded = pd.DataFrame.from_records(records, index=data.index, columns=keys)
+    return _add_columns(data, expanded)
+
+
+def _add_columns(data: pd.DataFrame, columns: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return a new frame with the columns added to data in a single concat.
+
+    Columns of data with the same name are replaced.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        the data to add the columns to, with the same index as columns
+    columns : pd.DataFrame
+        the columns to add
 
-    for key in keys:
-        data[key] = data[column].apply(lambda x: x.get(key))
+    Returns
+    -------
+    pd.DataFrame
+        the data with the columns added
+    """
+    replaced = data.columns.intersection(columns.columns)
+    if len(replaced) > 0:
+        data = data.drop(columns=replaced)
+    return pd.concat([data, columns], axis=1, copy=False)
+
+
+def expand_count_column(data: pd.DataFrame, column: str, keys: List) -> pd.DataFrame:
+    """
+    expand_count_column expands a dict column of integer counts.
+
+    Columns like public_metrics always hold the same integer counts, so the
+    values of all keys are read from each dict in one pass into a single
+    int64 array. If a dict or a key is missing, or a count is not an
+    integer, the column is expanded with expand_dict_column instead; the
+    counts are then nullable Int64 columns, with missing values for the
+    counts that are missing or not numbers.
+    data is not modified, a new frame with the expanded columns is returned.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        the data to expand
+    column : str
+        the column to expand
+    keys : List
+        the keys to expand
+
+    Returns
+    -------
+    pd.DataFrame
+        a new frame, the data with the expanded column
+    """
+    getter = itemgetter(*keys)
+    try:
+        values = np.array([getter(value) for value in data[column]], dtype=np.int64)
+    except (KeyError, TypeError, ValueError):
+        expanded = expand_dict_column(data, column, keys)
+        for key in keys:
+            expanded[key] = pd.to_numeric(expanded[key], errors="coerce").astype(
+                "Int64"
+            )
+        return expanded
+    values = values.reshape(len(data), len(keys))
+    return _add_columns(data, pd.DataFrame(values, index=data.index, columns=keys))
+
+
+def convert_id_columns(data: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """
+    convert_id_columns converts id columns to integers.
+
+    The twitter API returns ids as strings, the tables store them as
+    64-bit integers. The nullable Int64 dtype is used so that columns with
+    missing values are not cast to float, which would round the ids. The
+    strings are parsed in one vectorized cast from the string dtype, so all
+    later comparisons and joins on the ids work on integer arrays.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        the data with the id columns
+    columns : List[str]
+        the id columns to convert
+
+    Returns
+    -------
+    data : pd.DataFrame
+        the data with the converted id columns
+    """
+    for column in columns:
+        data[column] = pd.array(data[column], dtype="string").astype("Int64")
     return data
 
 
@@ -61,11 +188,11 @@ def validate_object(object: pd.DataFrame, object_type: str):
         if the object does not have the correct columns or has no rows
     """
     assert (
-        object_type in object_columns.keys()
+        object_type in object_column_sets
     ), f"Object type must be one of {object_columns.keys()}"
     assert object.shape[0] > 0, f"{object_type} must have at least one row"
-    assert set(object.columns) == set(
-        object_columns[object_type]
+    assert (
+        set(object.columns) == object_column_sets[object_type]
     ), f"{object_type} columns must be {object_columns[object_type]}"
 
 
@@ -87,19 +214,37 @@ def referenced_tweet_column_processing(
     tables : Dict[str, List[pd.DataFrame]]
          The tables to upload to the database with the refrenced tweets added
     """
-    columns = ["id", "in_reply_to_user_id", "referenced_tweets"]
-    referenced_tweets = tweet_object[columns]
-    referenced_tweets = referenced_tweets.explode("referenced_tweets")
-    referenced_tweets.dropna(subset=["referenced_tweets"], inplace=True)
-    referenced_tweets.reset_index(drop=True, inplace=True)
-
-    referenced_tweets.rename({"id": "actual_id"}, axis=1, inplace=True)
-
-    expand_dict_column(referenced_tweets, "referenced_tweets", ["id", "type"])
-
-    referenced_tweets.rename(
-        {"id": "tweet_id", "actual_id": "id"}, axis=1, inplace=True
+    # one bit per reference type, 0 for unknown types
+    type_flags = {
+        "quoted": 1,
+        "retweeted": 2,
+        "replied_to": 4,
+    }
+    # flatten the lists of references, the columns of the tweet are repeated
+    # once per reference. The type is stored as its flag, so filtering by type
+    # compares integers.
+    lengths = []
+    referenced_ids = []
+    type_codes = []
+    for refs in tweet_object["referenced_tweets"]:
+        if not isinstance(refs, list):
+            lengths.append(0)
+            continue
+        lengths.append(len(refs))
+        for ref in refs:
+            referenced_ids.append(ref.get("id"))
+            type_codes.append(type_flags.get(ref.get("type"), 0))
+    referenced_tweets = pd.DataFrame(
+        {
+            "id": tweet_object["id"].repeat(lengths).array,
+            "in_reply_to_user_id": (
+                tweet_object["in_reply_to_user_id"].repeat(lengths).array
+            ),
+            "tweet_id": referenced_ids,
+            "type": type_codes,
+        }
     )
+    convert_id_columns(referenced_tweets, ["tweet_id"])
 
     # TODO: fetch below from init
     columns_for_each = {
@@ -111,19 +256,20 @@ def referenced_tweet_column_processing(
             "in_reply_to_user_id",
         ],
     }
-    tweet_type = {
-        "quoted": 1,
-        "retweeted": 2,
-        "replied_to": 3,
-    }
+    types = referenced_tweets["type"].to_numpy()
     for key, columns_for_table in columns_for_each.items():
         table_name = key + "_tweet_mapping"
         tables[table_name].append(
-            referenced_tweets[referenced_tweets["type"] == key][columns_for_table]
+            referenced_tweets.loc[types == type_flags[key], columns_for_table]
         )
-        tweet_object.loc[
-            tweet_object["id"].isin(pd.concat(tables[table_name])["id"]), "tweet_type"
-        ] += tweet_type[key]
+
+    # the distinct flags of a tweet are summed into a bit mask, which
+    # _tweet_type_codes maps to the codes documented on Tweet.tweet_type;
+    # tweets without references are originals (0)
+    references = referenced_tweets[["id", "type"]].drop_duplicates()
+    masks = references["type"].groupby(references["id"]).sum()
+    masks = tweet_object["id"].map(masks).fillna(0).to_numpy(dtype=np.int8)
+    tweet_object["tweet_type"] = _tweet_type_codes[masks]
 
     return tables
 
@@ -147,19 +293,37 @@ def entity_column_processing(
         The tables to upload to the database with the entities added
     """
     entities = ["mentions", "urls", "hashtags", "annotations", "cashtags"]
-    object = object[["entities", "id"]].dropna().copy()
-    for entity in entities:
-        object[entity] = object.apply(lambda x: x["entities"].get(entity), axis=1)
+    has_entities = object["entities"].notna()
+    ids = object.loc[has_entities, "id"]
+    # one pass over the entity dicts for all entity types
+    entity_columns = pd.DataFrame.from_records(
+        object.loc[has_entities, "entities"].tolist(), columns=entities
+    )
 
     for entity in entities:
-        current_table = object[["id", entity]].explode(entity)
-        current_table.rename({"id": "tweet_id"}, axis=1, inplace=True)
-        current_table.dropna(subset=[entity], inplace=True)
-        current_table.reset_index(drop=True, inplace=True)
+        # flatten the lists of entities, the tweet id is repeated once per entity
+        values = entity_columns[entity]
+        lengths = [len(value) if isinstance(value, list) else 0 for value in values]
+        flat = [item for value in values if isinstance(value, list) for item in value]
+        current_table = pd.DataFrame(
+            {"tweet_id": ids.repeat(lengths).array, entity: flat}
+        )
         if not current_table.empty:
-            expand_dict_column(current_table, entity)
+            current_table = expand_dict_column(
+                current_table, entity, dict_column_keys["entities"][entity]
+            )
             if entity == "mentions":
                 current_table.rename({"id": "author_id"}, axis=1, inplace=True)
+                convert_id_columns(current_table, ["author_id"])
+            if entity == "annotations":
+                # types outside AnnotationType are stored as OTHER
+                current_table["type"] = (
+                    current_table["type"]
+                    .str.upper()
+                    .map(_annotation_type_codes)
+                    .fillna(AnnotationType.OTHER)
+                    .astype("int16")
+                )
             current_table = current_table[table_columns[entity + "_tweet_mapping"]]
         tables[entity + "_tweet_mapping"].append(current_table)
     return tables
@@ -186,13 +350,24 @@ def tweet_object_to_table(
         tables that have been updated with the tweet_object
     """
     # validate_object(tweet_object, "tweet_object")
-    tweet_object["tweet_type"] = 0
+    convert_id_columns(
+        tweet_object, ["id", "author_id", "conversation_id", "in_reply_to_user_id"]
+    )
+    tweet_object["text"] = tweet_object["text"].map(sanitize_text, na_action="ignore")
+    # sets tweet_type on this frame, before the expansions below return new frames
     referenced_tweet_column_processing(tweet_object, tables)
 
-    tweet_object = expand_dict_column(tweet_object, "public_metrics")
-    # tweet_object = expand_dict_column(tweet_object, "edit_controls")
+    tweet_object = expand_count_column(
+        tweet_object,
+        "public_metrics",
+        dict_column_keys["tweet_object"]["public_metrics"],
+    )
+    # tweet_object = expand_dict_column(
+    #     tweet_object,
+    #     "edit_controls",
+    #     dict_column_keys["tweet_object"]["edit_controls"],
+    # )
 
-    # TODO: Add processing for referenced tweets and assign tweet_type
     entity_column_processing(tweet_object, tables)
 
     columns_for_tweet_table = table_columns["tweet"]
@@ -218,8 +393,14 @@ def user_object_to_table(user_object: pd.DataFrame, tables: Dict[str, pd.DataFra
         tables that have been updated with the user_object
     """
     # validate_object(user_object, "user_object")
+    convert_id_columns(user_object, ["id"])
+    user_object["description"] = user_object["description"].map(
+        sanitize_text, na_action="ignore"
+    )
 
-    user_object = expand_dict_column(user_object, "public_metrics")
+    user_object = expand_count_column(
+        user_object, "public_metrics", dict_column_keys["user_object"]["public_metrics"]
+    )
 
     columns_for_user_table = table_columns["author"]
     tables["author"].append(user_object[columns_for_user_table])
@@ -0,0 +1 @@
+"""Tests for the twarc2sql.file_utils module."""
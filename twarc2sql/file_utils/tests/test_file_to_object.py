@@ -0,0 +1,43 @@
+"""
+Tests for the file_to_object module.
+
+The tests are run using pytest. To run the tests, use the following command from the
+root directory of the project:
+
+    pytest twarc2sql/file_utils/tests/test_file_to_object.py
+
+"""
+
+from twarc2sql.file_utils.file_to_object import append_records
+
+
+def test_append_records_new_column():
+    """
+    Test that a column first seen in a later record is padded.
+
+    The earlier rows of the new column must be None, so all columns keep the
+    same length.
+    """
+    columns = append_records({}, [{"id": "1"}, {"id": "2", "lang": "en"}])
+    assert columns == {"id": ["1", "2"], "lang": [None, "en"]}
+
+    # rows appended to columns of an earlier call are padded as well:
+    append_records(columns, [{"id": "3", "text": "hi"}])
+    assert columns == {
+        "id": ["1", "2", "3"],
+        "lang": [None, "en", None],
+        "text": [None, None, "hi"],
+    }
+
+
+def test_append_records_missing_column():
+    """
+    Test that a column missing from a record gets None.
+
+    The columns must not be shifted: every value stays in the row of its
+    record.
+    """
+    columns = append_records(
+        {}, [{"id": "1", "lang": "en"}, {"id": "2"}, {"id": "3", "lang": "de"}]
+    )
+    assert columns == {"id": ["1", "2", "3"], "lang": ["en", None, "de"]}
@@ -0,0 +1,183 @@
+"""
+Tests for the file_utils module.
+
+The tests are run using pytest. To run the tests, use the following command from the
+root directory of the project:
+
+    pytest twarc2sql/file_utils/tests/test_file_utils.py
+
+"""
+
+import json
+from typing import Dict, List
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from twarc2sql.db_utils.models import Base
+from twarc2sql.file_utils import file_utils
+
+FOLDER_PATH = "tests/data/"
+FILE_NAME = "search_example.jsonl"
+
+# rows of the example files per table
+ROW_COUNTS = {
+    "search_example.jsonl": {
+        "author": 332,
+        "tweet": 811,
+        "retweeted_tweet_mapping": 354,
+        "quoted_tweet_mapping": 54,
+        "replied_to_tweet_mapping": 42,
+        "mentions_tweet_mapping": 2788,
+        "hashtags_tweet_mapping": 2840,
+        "cashtags_tweet_mapping": 12,
+        "urls_tweet_mapping": 814,
+        "annotations_tweet_mapping": 1167,
+    },
+    # no tweet of this file has cashtags
+    "example.jsonl": {
+        "author": 128,
+        "tweet": 128,
+        "retweeted_tweet_mapping": 70,
+        "quoted_tweet_mapping": 5,
+        "replied_to_tweet_mapping": 12,
+        "mentions_tweet_mapping": 95,
+        "hashtags_tweet_mapping": 345,
+        "cashtags_tweet_mapping": 0,
+        "urls_tweet_mapping": 95,
+        "annotations_tweet_mapping": 107,
+    },
+}
+TABLES = list(ROW_COUNTS[FILE_NAME])
+
+
+def row_counts(connection: sa.engine.Connection) -> Dict[str, int]:
+    """Return the number of rows of each table in TABLES."""
+    return {
+        table: connection.scalar(
+            sa.select(sa.func.count()).select_from(Base.metadata.tables[table])
+        )
+        for table in TABLES
+    }
+
+
+def table_rows(connection: sa.engine.Connection) -> Dict[str, List[tuple]]:
+    """Return the sorted rows of each table in TABLES."""
+    return {
+        table: sorted(
+            map(tuple, connection.execute(sa.select(Base.metadata.tables[table]))),
+            key=repr,
+        )
+        for table in TABLES
+    }
+
+
+def test_drop_duplicate_rows():
+    """
+    Test that rows repeating a primary key within a chunk are dropped.
+
+    Only the key columns are compared, the first row with a key is kept. Rows
+    of earlier chunks are left to the conflict skip of the upload, see
+    test_read_and_upload_file with one line per chunk.
+    """
+    data = pd.DataFrame(
+        {
+            "tweet_id": [1, 1, 1, 2],
+            "start": [0, 0, 5, 0],
+            "end": [4, 4, 9, 4],
+            "tag": ["first", "second", "other", "first"],
+        }
+    )
+    kept = file_utils.drop_duplicate_rows("hashtags_tweet_mapping", data)
+    assert kept["tag"].tolist() == ["first", "other", "first"]
+    assert kept.index.tolist() == [0, 2, 3]
+
+    kept = file_utils.drop_duplicate_rows("author", pd.DataFrame({"id": [3, 3, 4]}))
+    assert kept["id"].tolist() == [3, 4]
+
+
+def test_upload_to_database_float_counts(db_session):
+    """
+    Test that integer columns held as float are uploaded as integers.
+
+    pandas stores an integer column with missing values as float64; COPY
+    rejects integers formatted as floats (e.g. "10.0"), so the upload must
+    send them as integers and the missing values as NULL.
+    """
+    tables = {table: [] for table in file_utils.table_priority}
+    tables["author"].append(
+        pd.DataFrame(
+            {"id": [701, 702], "name": ["a", "b"], "followers_count": [10.0, None]}
+        )
+    )
+    file_utils.upload_to_database(tables, db_session)
+
+    rows = db_session.execute(
+        sa.text("SELECT id, followers_count FROM author WHERE id > 700 ORDER BY id")
+    )
+    assert rows.all() == [(701, 10), (702, None)]
+
+
+@pytest.mark.parametrize("chunksize", [1, 100])
+@pytest.mark.parametrize("file_name", list(ROW_COUNTS))
+def test_read_and_upload_file(db_session, file_name, chunksize):
+    """
+    Test that every row of the file is uploaded once.
+
+    Chunks in which no tweet has an entity type (e.g. cashtags) must be
+    uploaded as well. With one line per chunk, authors and referenced tweets
+    repeat across chunks; the rows sent again must be skipped.
+    """
+    file_utils.read_and_upload_file(
+        FOLDER_PATH, file_name, engine=db_session, chunksize=chunksize
+    )
+    assert row_counts(db_session) == ROW_COUNTS[file_name]
+
+
+def test_read_and_upload_file_twice(db_session):
+    """Test that uploading a file again adds no rows."""
+    file_utils.read_and_upload_file(FOLDER_PATH, FILE_NAME, engine=db_session)
+    rows = table_rows(db_session)
+    file_utils.read_and_upload_file(FOLDER_PATH, FILE_NAME, engine=db_session)
+    assert table_rows(db_session) == rows
+    assert row_counts(db_session) == ROW_COUNTS[FILE_NAME]
+
+
+def test_read_and_upload_file_workers(db_session):
+    """Test that processing the chunks in worker processes uploads the same rows."""
+    serial = db_session.begin_nested()
+    file_utils.read_and_upload_file(
+        FOLDER_PATH, FILE_NAME, engine=db_session, chunksize=1
+    )
+    rows = table_rows(db_session)
+    serial.rollback()
+    assert row_counts(db_session)["tweet"] == 0
+
+    file_utils.read_and_upload_file(
+        FOLDER_PATH, FILE_NAME, engine=db_session, max_workers=2, chunksize=1
+    )
+    assert table_rows(db_session) == rows
+
+
+def test_read_and_upload_file_missing_count(db_session, tmp_path):
+    """
+    Test that a tweet without one of its public_metrics counts is uploaded.
+
+    The missing count is stored as NULL, the counts of the other tweets are
+    kept.
+    """
+    with open(f"{FOLDER_PATH}{FILE_NAME}") as file:
+        response = json.loads(file.readline())
+    tweet = response["data"][0]
+    del tweet["public_metrics"]["impression_count"]
+    (tmp_path / FILE_NAME).write_text(json.dumps(response) + "\n")
+
+    file_utils.read_and_upload_file(tmp_path, FILE_NAME, engine=db_session)
+
+    impression_counts = dict(
+        db_session.execute(sa.text("SELECT id, impression_count FROM tweet")).all()
+    )
+    assert len(impression_counts) > 1
+    assert impression_counts.pop(int(tweet["id"])) is None
+    assert None not in impression_counts.values()
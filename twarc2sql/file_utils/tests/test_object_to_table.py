@@ -0,0 +1,171 @@
+"""
+Tests for the object_to_table module.
+
+The tests are run using pytest. To run the tests, use the following command from the
+root directory of the project:
+
+    pytest twarc2sql/file_utils/tests/test_object_to_table.py
+
+"""
+
+import pandas as pd
+import pytest
+
+from twarc2sql.db_utils.models import AnnotationType
+from twarc2sql.file_utils import object_to_table
+from twarc2sql.file_utils.file_utils import table_priority
+
+KEYS = ["retweet_count", "reply_count"]
+
+
+def test_expand_count_column():
+    """Test that integer counts are expanded into int64 columns."""
+    data = pd.DataFrame(
+        {"public_metrics": [{"retweet_count": 1, "reply_count": 2}] * 2}
+    )
+    expanded = object_to_table.expand_count_column(data, "public_metrics", KEYS)
+    assert expanded[KEYS].to_numpy().tolist() == [[1, 2], [1, 2]]
+    assert (expanded[KEYS].dtypes == "int64").all()
+    # data is not modified:
+    assert list(data.columns) == ["public_metrics"]
+
+
+@pytest.mark.parametrize(
+    "metrics",
+    [
+        {"retweet_count": 3},
+        {"retweet_count": 3, "reply_count": "n/a"},
+        None,
+    ],
+    ids=["missing count", "non-int count", "missing dict"],
+)
+def test_expand_count_column_fallback(metrics):
+    """
+    Test that expand_count_column falls back to expand_dict_column.
+
+    A missing count, a count that is not an integer or a missing dict must
+    not raise; the other rows keep their counts. The counts stay integers,
+    with missing values for the counts that are missing or not numbers.
+    """
+    data = pd.DataFrame(
+        {"public_metrics": [{"retweet_count": 1, "reply_count": 2}, metrics]}
+    )
+    expanded = object_to_table.expand_count_column(data, "public_metrics", KEYS)
+    assert expanded.loc[0, KEYS].tolist() == [1, 2]
+    assert (expanded[KEYS].dtypes == "Int64").all()
+    assert pd.isna(expanded.loc[1, "reply_count"])
+    if metrics is not None:
+        assert expanded.loc[1, "retweet_count"] == 3
+    assert list(data.columns) == ["public_metrics"]
+
+
+def test_expand_dict_column_without_dict():
+    """Test that a column without any dict raises a ValueError naming it."""
+    data = pd.DataFrame({"edit_controls": [None, None]})
+    with pytest.raises(ValueError, match="edit_controls"):
+        object_to_table.expand_dict_column(data, "edit_controls")
+
+
+def test_convert_id_columns():
+    """
+    Test that id strings are converted to nullable 64-bit integers.
+
+    Missing ids stay missing, and ids above 2**53 must not be rounded, as
+    they would be by a cast through float.
+    """
+    large_id = 2**53 + 1
+    data = pd.DataFrame({"id": [str(large_id), None, "1643324454234206209"]})
+    object_to_table.convert_id_columns(data, ["id"])
+    assert data["id"].dtype == "Int64"
+    assert data.loc[0, "id"] == large_id
+    assert data["id"].isna().tolist() == [False, True, False]
+    assert data.loc[2, "id"] == 1643324454234206209
+
+
+def test_tweet_type():
+    """
+    Test that tweet_type is set from the reference types of the tweet.
+
+    Originals are 0, quotes 1, retweets 2, replies 3 and quotes that are also
+    replies 4, as documented on Tweet.tweet_type.
+    """
+    references = {
+        1: None,
+        2: [{"type": "quoted", "id": "12"}],
+        3: [{"type": "retweeted", "id": "13"}],
+        4: [{"type": "replied_to", "id": "14"}],
+        5: [{"type": "quoted", "id": "15"}, {"type": "replied_to", "id": "16"}],
+    }
+    tweet_object = pd.DataFrame(
+        {
+            "id": list(references),
+            "in_reply_to_user_id": [None, None, None, "7", "7"],
+            "referenced_tweets": list(references.values()),
+        }
+    )
+    tables = {table: [] for table in table_priority}
+    object_to_table.referenced_tweet_column_processing(tweet_object, tables)
+
+    assert tweet_object["tweet_type"].tolist() == [0, 1, 2, 3, 4]
+    assert tables["quoted_tweet_mapping"][0]["id"].tolist() == [2, 5]
+    assert tables["retweeted_tweet_mapping"][0]["id"].tolist() == [3]
+    assert tables["replied_to_tweet_mapping"][0]["tweet_id"].tolist() == [14, 16]
+
+
+@pytest.mark.parametrize(
+    "types, code",
+    [
+        (["retweeted", "replied_to"], 2),
+        (["retweeted", "quoted"], 2),
+        (["retweeted", "quoted", "replied_to"], 2),
+        (["quoted", "quoted"], 1),
+        (["unknown"], 0),
+    ],
+)
+def test_tweet_type_combinations(types, code):
+    """
+    Test that other combinations of references get a documented code.
+
+    A retweet stays a retweet whatever its other references (summing the
+    weights would store 5 for a retweet of a reply, or 3 for a retweet of a
+    quote), repeated types count once and unknown types are ignored.
+    """
+    tweet_object = pd.DataFrame(
+        {
+            "id": [1],
+            "in_reply_to_user_id": [None],
+            "referenced_tweets": [
+                [{"type": type, "id": str(10 + i)} for i, type in enumerate(types)]
+            ],
+        }
+    )
+    tables = {table: [] for table in table_priority}
+    object_to_table.referenced_tweet_column_processing(tweet_object, tables)
+    assert tweet_object["tweet_type"].tolist() == [code]
+
+
+def test_annotation_types():
+    """
+    Test that annotation types are stored as AnnotationType codes.
+
+    Type names are matched case-insensitively; a type outside AnnotationType
+    is stored as OTHER, the known types of the chunk keep their codes.
+    """
+    annotations = [
+        {"start": 0, "end": 4, "probability": 0.9, "type": "Person"},
+        {"start": 6, "end": 9, "probability": 0.8, "type": "Event"},
+        {"start": 11, "end": 15, "probability": 0.7, "type": "Place"},
+    ]
+    tweet_object = pd.DataFrame(
+        {"id": [1, 2], "entities": [{"annotations": annotations}, None]}
+    )
+    tables = {table: [] for table in table_priority}
+    object_to_table.entity_column_processing(tweet_object, tables)
+
+    annotation_table = tables["annotations_tweet_mapping"][0]
+    assert annotation_table["type"].tolist() == [
+        AnnotationType.PERSON,
+        AnnotationType.OTHER,
+        AnnotationType.PLACE,
+    ]
+    assert annotation_table["type"].dtype == "int16"